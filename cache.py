@@ -0,0 +1,59 @@
+"""
+Cache Helper Functions
+
+Redis helpers for caching serialized responses of hot read endpoints.
+Caching is skipped entirely when REDIS_URL is not configured, and Redis
+errors are logged and treated as a miss so the cache never fails a request.
+"""
+
+import os
+import logging
+from typing import Optional
+from dotenv import load_dotenv
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+cache = None
+
+redis_url = os.getenv("REDIS_URL")
+content_ttl = int(os.getenv("CACHE_TTL", 300))
+# Keep these short: an unreachable Redis must time out into a miss, not stall requests
+socket_timeout = float(os.getenv("REDIS_TIMEOUT", 0.2))
+
+if redis_url:
+    cache = Redis.from_url(redis_url, socket_timeout=socket_timeout, socket_connect_timeout=socket_timeout)
+
+async def cache_get(key: str) -> Optional[bytes]:
+    """Return cached bytes for key, or None on miss / cache disabled"""
+    if cache is None:
+        return None
+    try:
+        return await cache.get(key)
+    except RedisError:
+        logger.exception("Redis GET failed for %s", key)
+        return None
+
+async def cache_set(key: str, value: bytes, ttl: Optional[int] = content_ttl) -> bool:
+    """Store bytes under key; ttl=None keeps it until invalidated. Returns whether it was stored"""
+    if cache is None:
+        return False
+    try:
+        await cache.set(key, value, ex=ttl)
+    except RedisError:
+        logger.exception("Redis SET failed for %s", key)
+        return False
+    return True
+
+async def cache_delete(*keys: str):
+    """Invalidate one or more cached keys"""
+    if cache is None:
+        return
+    try:
+        await cache.delete(*keys)
+    except RedisError:
+        logger.exception("Redis DELETE failed for %s", ", ".join(keys))
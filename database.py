@@ -5,11 +5,12 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
@@ -21,12 +22,30 @@ db = None
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
+# Split a ~100 connection budget across server worker processes
+workers = int(os.getenv("WORKERS", 1))
+max_pool_size = int(os.getenv("DATABASE_MAX_POOL_SIZE", max(10, 100 // workers)))
+
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    _client = AsyncIOMotorClient(database_url, maxPoolSize=max_pool_size, compressors="zstd,zlib")
     db = _client[database_name]
 
+# Aggregation stages replacing the ObjectId "_id" with a string "id" field
+ID_AS_STRING = [
+    {"$set": {"id": {"$toString": "$_id"}}},
+    {"$unset": "_id"},
+]
+
+class PartialInsertError(Exception):
+    """Raised when an unordered bulk insert writes only some of the documents"""
+
+    def __init__(self, inserted_ids: List[str], write_errors: List[dict]):
+        super().__init__(f"{len(write_errors)} of {len(inserted_ids) + len(write_errors)} documents failed to insert")
+        self.inserted_ids = inserted_ids
+        self.write_errors = write_errors
+
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,10 +59,36 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def create_documents(collection_name: str, items: List[Union[BaseModel, dict]]):
+    """Insert many documents with timestamps in a single unordered batch"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for data in items:
+        data_dict = data.model_dump() if isinstance(data, BaseModel) else data.copy()
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+        docs.append(data_dict)
+
+    try:
+        result = await db[collection_name].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # insert_many assigns _id to every doc up front, so the survivors are known
+        write_errors = [
+            {"index": err["index"], "code": err.get("code"), "message": err.get("errmsg")}
+            for err in e.details.get("writeErrors", [])
+        ]
+        failed = {err["index"] for err in write_errors}
+        inserted_ids = [str(doc["_id"]) for i, doc in enumerate(docs) if i not in failed]
+        raise PartialInsertError(inserted_ids, write_errors) from e
+    return [str(inserted_id) for inserted_id in result.inserted_ids]
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -51,5 +96,27 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     cursor = db[collection_name].find(filter_dict or {})
     if limit:
         cursor = cursor.limit(limit)
-    
-    return list(cursor)
+
+    return await cursor.to_list(length=None)
+
+async def get_documents_with_id(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None):
+    """Get documents with "_id" converted to a string "id" server-side"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    pipeline = [{"$match": filter_dict or {}}]
+    if limit:
+        pipeline.append({"$limit": limit})
+    if projection:
+        pipeline.append({"$project": projection})
+    pipeline.extend(ID_AS_STRING)
+
+    return await db[collection_name].aggregate(pipeline).to_list(length=None)
+
+def stream_documents_with_id(collection_name: str, filter_dict: dict = None, batch_size: int = 500):
+    """Iterate documents with a string "id" without loading the whole collection"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    pipeline = [{"$match": filter_dict or {}}, *ID_AS_STRING]
+    return db[collection_name].aggregate(pipeline, batchSize=batch_size)
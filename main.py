@@ -1,36 +1,67 @@
 import os
-from fastapi import FastAPI, HTTPException, Depends
+import asyncio
+import logging
+import hmac
+import hashlib
+import orjson
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.security import APIKeyHeader
+from pydantic import BaseModel, AfterValidator, field_validator
+from typing import List, Optional, Annotated
 from bson import ObjectId
+from pymongo.errors import PyMongoError
 
-from database import db, create_document, get_documents
+from database import db, create_document, create_documents, PartialInsertError, get_documents_with_id, stream_documents_with_id
+from cache import cache_get, cache_set, cache_delete
 from schemas import TattooService, PortfolioItem, Appointment, BotSession, AdminLogin
 
-app = FastAPI(title="Tattoo Artist API")
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Index the hot lookups: bot session by user, public services by is_active.
+    # Best effort: an unreachable Mongo must not keep workers from booting.
+    if db is not None:
+        try:
+            await asyncio.wait_for(asyncio.gather(
+                db["botsession"].create_index("telegram_user_id"),
+                db["tattooservice"].create_index("is_active"),
+            ), timeout=5)
+        except (PyMongoError, asyncio.TimeoutError):
+            logger.exception("Could not create MongoDB indexes at startup")
+    yield
+
+
+app = FastAPI(title="Tattoo Artist API", default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# Comma-separated frontend origins; admin auth is a header, so no credentials
+frontend_origins = [origin.strip() for origin in os.getenv("FRONTEND_URL", "").split(",") if origin.strip()]
+if not frontend_origins:
+    logger.warning("FRONTEND_URL is not set; cross-origin browser requests will be rejected")
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=frontend_origins,
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "x-admin-token"],
+    max_age=86400,
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 
 # Utils
-class ObjectIdStr(str):
-    @classmethod
-    def __get_validators__(cls):
-        yield cls.validate
+def check_object_id(v: str) -> str:
+    if not ObjectId.is_valid(v):
+        raise ValueError("Invalid ObjectId")
+    return v
 
-    @classmethod
-    def validate(cls, v):
-        try:
-            return str(ObjectId(str(v)))
-        except Exception:
-            raise ValueError("Invalid ObjectId")
+
+ObjectIdStr = Annotated[str, AfterValidator(check_object_id)]
 
 
 def get_admin_secret():
@@ -38,91 +69,202 @@ def get_admin_secret():
     return secret
 
 
-def require_admin(password: str):
-    if password != get_admin_secret():
+def hash_secret(secret: str) -> bytes:
+    return hashlib.sha256(secret.encode()).digest()
+
+
+ADMIN_SECRET_HASH = hash_secret(get_admin_secret())
+
+
+admin_token_header = APIKeyHeader(name="X-Admin-Token", auto_error=False)
+
+
+def require_admin(token: Optional[str] = Depends(admin_token_header)):
+    if token is None or not hmac.compare_digest(hash_secret(token), ADMIN_SECRET_HASH):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
 
-@app.get("/")
-def root():
-    return {"message": "Tattoo Artist Backend is running"}
+def json_response(content: bytes) -> Response:
+    return Response(content=content, media_type="application/json")
 
 
-@app.get("/schema")
-def schema_overview():
-    return {
-        "tattooservice": TattooService.model_json_schema(),
-        "portfolioitem": PortfolioItem.model_json_schema(),
-        "appointment": Appointment.model_json_schema(),
-        "botsession": BotSession.model_json_schema(),
-    }
+# Only the model fields are returned publicly, so don't fetch the rest
+SERVICE_FIELDS = {name: 1 for name in TattooService.model_fields}
+PORTFOLIO_FIELDS = {name: 1 for name in PortfolioItem.model_fields}
 
 
-# Public content endpoints
-@app.get("/services")
-def list_services():
-    items = get_documents("tattooservice", {"is_active": True})
-    for it in items:
-        it["id"] = str(it.pop("_id"))
-    return items
+# JSON schemas are derived from static models, so build and serialize them once
+SCHEMAS = {
+    "tattooservice": TattooService.model_json_schema(),
+    "portfolioitem": PortfolioItem.model_json_schema(),
+    "appointment": Appointment.model_json_schema(),
+    "botsession": BotSession.model_json_schema(),
+}
+SCHEMAS_JSON = orjson.dumps(SCHEMAS)
+
+
+@app.get("/")
+async def root():
+    return {"message": "Tattoo Artist Backend is running"}
 
 
-@app.get("/portfolio")
-def list_portfolio():
-    items = get_documents("portfolioitem", {})
-    for it in items:
-        it["id"] = str(it.pop("_id"))
-    return items
+@app.get("/schema", response_model=None)
+async def schema_overview():
+    return json_response(SCHEMAS_JSON)
 
 
-class AppointmentCreate(Appointment):
-    pass
+# Public content endpoints
+@app.get("/services", response_model=None)
+async def list_services():
+    cached = await cache_get("services")
+    if cached is not None:
+        return json_response(cached)
+    items = await get_documents_with_id("tattooservice", {"is_active": True}, projection=SERVICE_FIELDS)
+    content = orjson.dumps(items)
+    await cache_set("services", content)
+    return json_response(content)
+
+
+@app.get("/portfolio", response_model=None)
+async def list_portfolio():
+    cached = await cache_get("portfolio")
+    if cached is not None:
+        return json_response(cached)
+    items = await get_documents_with_id("portfolioitem", {}, projection=PORTFOLIO_FIELDS)
+    content = orjson.dumps(items)
+    await cache_set("portfolio", content)
+    return json_response(content)
 
 
 @app.post("/appointments")
-def create_appointment(payload: AppointmentCreate):
-    data = payload.model_dump()
-    inserted_id = create_document("appointment", data)
+async def create_appointment(payload: Appointment):
+    inserted_id = await create_document("appointment", payload)
     return {"id": inserted_id}
 
 
-# Admin endpoints (simple password check)
+# Admin endpoints (password sent in the X-Admin-Token header)
 class AdminAuth(BaseModel):
     password: str
 
 
-@app.get("/admin/appointments")
-def admin_list_appointments(password: str):
-    require_admin(password)
-    items = get_documents("appointment", {})
-    for it in items:
-        it["id"] = str(it.pop("_id"))
-    return items
+@app.get("/admin/appointments", response_model=None, dependencies=[Depends(require_admin)])
+async def admin_list_appointments():
+    items = await get_documents_with_id("appointment", {})
+    return ORJSONResponse(items)
 
 
-@app.post("/admin/services")
-def admin_add_service(payload: TattooService, password: str):
-    require_admin(password)
-    inserted_id = create_document("tattooservice", payload)
+async def bulk_insert(collection_name: str, cache_key: str, payload: list):
+    if not payload:
+        return {"ids": []}
+    try:
+        inserted_ids = await create_documents(collection_name, payload)
+    except PartialInsertError as e:
+        # 207 so the admin can resend only the failed indexes
+        return ORJSONResponse(status_code=207, content={
+            "ids": e.inserted_ids,
+            "nInserted": len(e.inserted_ids),
+            "errors": e.write_errors,
+        })
+    finally:
+        # an unordered batch can fail after inserting part of the documents
+        await cache_delete(cache_key)
+    return {"ids": inserted_ids}
+
+
+@app.post("/admin/services", dependencies=[Depends(require_admin)])
+async def admin_add_service(payload: TattooService):
+    inserted_id = await create_document("tattooservice", payload)
+    await cache_delete("services")
     return {"id": inserted_id}
 
 
-@app.post("/admin/portfolio")
-def admin_add_portfolio(payload: PortfolioItem, password: str):
-    require_admin(password)
-    inserted_id = create_document("portfolioitem", payload)
+@app.post("/admin/services/bulk", dependencies=[Depends(require_admin)])
+async def admin_add_services_bulk(payload: List[TattooService]):
+    return await bulk_insert("tattooservice", "services", payload)
+
+
+@app.post("/admin/portfolio", dependencies=[Depends(require_admin)])
+async def admin_add_portfolio(payload: PortfolioItem):
+    inserted_id = await create_document("portfolioitem", payload)
+    await cache_delete("portfolio")
     return {"id": inserted_id}
 
 
+@app.post("/admin/portfolio/bulk", dependencies=[Depends(require_admin)])
+async def admin_add_portfolio_bulk(payload: List[PortfolioItem]):
+    return await bulk_insert("portfolioitem", "portfolio", payload)
+
+
 # Telegram Bot webhook style endpoint (simple stateful flow)
 class TelegramUpdate(BaseModel):
     message_text: Optional[str] = None
     user_id: Optional[int] = None
     username: Optional[str] = None
 
+    @field_validator("message_text", mode="before")
+    @classmethod
+    def strip_message_text(cls, v):
+        return v.strip() if isinstance(v, str) else v
+
+
+# Linear bot steps: state -> (data field to fill, next state, reply)
+BOT_FLOW = {
+    "ask_name": ("client_name", "ask_phone", "Оставь телефон или @username для связи"),
+    "ask_phone": ("phone", "ask_date", "Когда тебе удобно? Укажи дату (например, 2025-11-20)"),
+    "ask_date": ("preferred_date", "ask_time", "А во сколько примерно?"),
+    "ask_time": ("preferred_time", "ask_note", "Добавь пожелания по стилю/размеру (или напиши — нет)"),
+}
+
+
+# States in conversation order; a session only ever moves forward through these
+BOT_STATES = ["ask_name", "ask_phone", "ask_date", "ask_time", "ask_note", "complete"]
+
+
+# Active bot sessions are cached in Redis so each message skips the Mongo read
+BOT_SESSION_TTL = 600
+
+
+def bot_session_key(user_id: int) -> str:
+    return "botsession:" + str(user_id)
+
+
+async def load_bot_session(user_id: int) -> Optional[dict]:
+    cached = await cache_get(bot_session_key(user_id))
+    if cached is not None:
+        return orjson.loads(cached)
+    session = await db["botsession"].find_one({"telegram_user_id": user_id}, {"_id": 0, "state": 1, "data": 1})
+    if session:
+        await save_bot_session(user_id, session.get("state", "ask_name"), session.get("data", {}))
+    return session
+
+
+async def save_bot_session(user_id: int, state: str, data: dict) -> bool:
+    session = {"state": state, "data": data}
+    return await cache_set(bot_session_key(user_id), orjson.dumps(session), ttl=BOT_SESSION_TTL)
+
+
+async def persist_bot_session(user_id: int, state: str, data: dict):
+    # Only move forward: a late write from an earlier step matches nothing instead
+    # of overwriting a newer state. Each write carries the full data, so skipping
+    # an older one loses nothing.
+    earlier_states = BOT_STATES[:BOT_STATES.index(state)]
+    await db["botsession"].update_one(
+        {"telegram_user_id": user_id, "state": {"$in": earlier_states}},
+        {"$set": {"state": state, "data": data}},
+    )
+
+
+async def update_bot_session(user_id: int, state: str, data: dict, background_tasks: BackgroundTasks):
+    # The Mongo write may trail the reply only while Redis holds the new state;
+    # otherwise Mongo is the sole store and the next message must see the write
+    if await save_bot_session(user_id, state, data):
+        background_tasks.add_task(persist_bot_session, user_id, state, data)
+    else:
+        await persist_bot_session(user_id, state, data)
+
 
 @app.post("/bot/update")
-def bot_update(update: TelegramUpdate):
+async def bot_update(update: TelegramUpdate, background_tasks: BackgroundTasks):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
@@ -131,69 +273,63 @@ def bot_update(update: TelegramUpdate):
         raise HTTPException(status_code=400, detail="user_id required")
 
     # find or create session
-    session = db["botsession"].find_one({"telegram_user_id": user_id})
+    session = await load_bot_session(user_id)
     if not session:
-        session_id = create_document("botsession", {
+        await create_document("botsession", {
             "telegram_user_id": user_id,
             "state": "ask_name",
             "data": {},
         })
-        session = db["botsession"].find_one({"_id": ObjectId(session_id)})
-        reply = "Привет! Как тебя зовут?"
-        return {"reply": reply, "state": session.get("state")}
+        await save_bot_session(user_id, "ask_name", {})
+        return {"reply": "Привет! Как тебя зовут?", "state": "ask_name"}
 
     state = session.get("state", "ask_name")
     data = session.get("data", {})
-    text = (update.message_text or "").strip()
-
-    if state == "ask_name":
-        if not text:
-            return {"reply": "Напиши, пожалуйста, как к тебе обращаться", "state": state}
-        data["client_name"] = text
-        db["botsession"].update_one({"_id": session["_id"]}, {"$set": {"state": "ask_phone", "data": data}})
-        return {"reply": "Оставь телефон или @username для связи", "state": "ask_phone"}
-
-    if state == "ask_phone":
-        data["phone"] = text
-        db["botsession"].update_one({"_id": session["_id"]}, {"$set": {"state": "ask_date", "data": data}})
-        return {"reply": "Когда тебе удобно? Укажи дату (например, 2025-11-20)", "state": "ask_date"}
-
-    if state == "ask_date":
-        data["preferred_date"] = text
-        db["botsession"].update_one({"_id": session["_id"]}, {"$set": {"state": "ask_time", "data": data}})
-        return {"reply": "А во сколько примерно?", "state": "ask_time"}
-
-    if state == "ask_time":
-        data["preferred_time"] = text
-        db["botsession"].update_one({"_id": session["_id"]}, {"$set": {"state": "ask_note", "data": data}})
-        return {"reply": "Добавь пожелания по стилю/размеру (или напиши — нет)", "state": "ask_note"}
+    text = update.message_text or ""
+
+    if state == "ask_name" and not text:
+        return {"reply": "Напиши, пожалуйста, как к тебе обращаться", "state": state}
+
+    step = BOT_FLOW.get(state)
+    if step:
+        field, next_state, reply = step
+        data[field] = text
+        await update_bot_session(user_id, next_state, data, background_tasks)
+        return {"reply": reply, "state": next_state}
 
     if state == "ask_note":
         data["note"] = text
         data["source"] = "bot"
         data["telegram_user_id"] = user_id
-        app_id = create_document("appointment", data)
-        db["botsession"].update_one({"_id": session["_id"]}, {"$set": {"state": "complete"}})
+        app_id = await create_document("appointment", data)
+        await update_bot_session(user_id, "complete", data, background_tasks)
         return {"reply": "Готово! Я записал заявку №" + app_id + ". Мы свяжемся с тобой.", "state": "complete"}
 
     return {"reply": "Напиши любое сообщение, чтобы начать запись", "state": "ask_name"}
 
 
-# Simple JSON export for backups
-@app.get("/backup/export")
-def export_backup(password: str):
-    require_admin(password)
+# Streaming NDJSON export for backups
+@app.get("/backup/export", response_model=None, dependencies=[Depends(require_admin)])
+async def export_backup():
+    # fail before the 200 goes out rather than truncating the stream
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not configured")
+
     collections = ["tattooservice", "portfolioitem", "appointment", "botsession"]
-    dump = {}
-    for col in collections:
-        docs = list(db[col].find({}))
-        for d in docs:
-            d["id"] = str(d.pop("_id"))
-        dump[col] = docs
-    return dump
+
+    async def ndjson():
+        # one {"collection": ...} header line, then one line per document
+        for col in collections:
+            yield orjson.dumps({"collection": col}) + b"\n"
+            async for doc in stream_documents_with_id(col):
+                yield orjson.dumps(doc) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WORKERS", 2 * (os.cpu_count() or 1) + 1))
+    os.environ["WORKERS"] = str(workers)  # read by worker processes to size their pool
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers, loop="uvloop", http="httptools")